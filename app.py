@@ -10,13 +10,25 @@ else:
     load_dotenv()
 
 import logging
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Any, Dict, List, Optional
 
+import orjson
 from flask import Flask, abort, jsonify, request
+from flask.json.provider import JSONProvider
+from werkzeug.exceptions import HTTPException
 import meta_client
-from media_store import ingest_data_url_to_s3, ingest_inline_media
+from media_store import (
+    MediaError, get_media_url, ingest_data_url_to_s3, ingest_inline_media, probe_media_url,
+)
 from queue_store_s3 import (
-    add_draft, approve_post, get_post, mark_posted, pick_next_for_channel,
+    PostNotReady,
+    add_draft, approve_post, buffered_drafts, finish_ingest, get_job, get_post, mark_posted,
+    pick_next_for_channel, recent_post_count, save_job,
 )
 from scheduler import slot_channel_for_today
 
@@ -27,33 +39,147 @@ if os.path.exists(ENV_PATH):
 else:
     load_dotenv()
 
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson (used by jsonify and request.get_json)."""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+class HealthzMiddleware:
+    """Answer GET/HEAD /healthz at the WSGI layer, before Flask routing runs (LB probes)."""
+
+    BODY = b'{"ok":true}'
+    HEADERS = [("Content-Type", "application/json"), ("Content-Length", str(len(BODY)))]
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        if environ.get("PATH_INFO") == "/healthz" and environ.get("REQUEST_METHOD") in ("GET", "HEAD"):
+            start_response("200 OK", list(self.HEADERS))
+            return [] if environ["REQUEST_METHOD"] == "HEAD" else [self.BODY]
+        return self.wsgi_app(environ, start_response)
+
 app = Flask(__name__)
+app.wsgi_app = HealthzMiddleware(app.wsgi_app)
+app.json = OrjsonProvider(app)
+# Werkzeug rejects larger bodies with 413 before any handler reads them.
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_BODY_MB", "16")) * 1024 * 1024
 logging.basicConfig(level=logging.INFO)
 
+_BOOL_TRUE = frozenset({"1", "true", "yes", "y", "on"})
+
 def _bool(v: Optional[str], default: bool = False) -> bool:
     if v is None:
         return default
-    return str(v).strip().lower() in ("1", "true", "yes", "y", "on")
+    return str(v).strip().lower() in _BOOL_TRUE
+
+# Inline/data-URL media is decoded and uploaded off the request thread.
+MAX_INLINE_BYTES = int(os.getenv("MAX_INLINE_MB", "8")) * 1024 * 1024
+INGEST_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("INGEST_WORKERS", "4")),
+                                 thread_name_prefix="ingest")
+# /drafts/bulk checks the items' media_url probes concurrently, this many at a time
+BULK_PROBE_WORKERS = int(os.getenv("BULK_PROBE_WORKERS", "8"))
+
+# Publish throttling: bound concurrent Graph publishes per worker and cap
+# posts per channel per rolling 24h (0 = no cap) to protect Meta rate budgets.
+PUBLISH_SEM = threading.BoundedSemaphore(int(os.getenv("MAX_CONCURRENT_PUBLISH", "4")))
+PUBLISH_WAIT_S = float(os.getenv("PUBLISH_WAIT_S", "30"))
+DAILY_POST_LIMITS = {
+    "instagram": int(os.getenv("IG_DAILY_POST_LIMIT", "25")),
+    "facebook": int(os.getenv("FB_DAILY_POST_LIMIT", "0")),
+}
+# Publishes that passed the cap check but aren't recorded by mark_posted yet.
+# Reservations are per worker; other workers are seen through a fresh S3 count.
+# _CAP_RECORDED counts this worker's completed publishes, so a count taken
+# outside the lock can be topped up with ones that landed while it ran.
+_CAP_LOCK = threading.Lock()
+_CAP_INFLIGHT = {"instagram": 0, "facebook": 0}
+_CAP_RECORDED = {"instagram": 0, "facebook": 0}
+
+# Scheduler runs: WORKER_INLINE=1 opts into queueing them onto a background
+# thread in this worker (202 + job id); the default keeps the synchronous response.
+# The queue is in memory: jobs of a recycled/killed worker are lost, and
+# /scheduler/status reports them as "stale" after JOB_STALE_S.
+WORKER_INLINE = _bool(os.getenv("WORKER_INLINE"), False)
+JOB_STALE_S = float(os.getenv("JOB_STALE_S", "900"))
+JOB_QUEUE: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+_worker_pid: Optional[int] = None
+_worker_lock = threading.Lock()
+
+class PublishThrottled(RuntimeError):
+    """Publishing refused for now; surfaced as an HTTP error with Retry-After."""
+
+    def __init__(self, message: str, status: int = 503, retry_after: int = 5):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
 
 @app.errorhandler(Exception)
 def handle_any_error(e):
     app.logger.error("Unhandled exception: %s", e, exc_info=True)
     return jsonify(error="Internal server error"), 500
 
+@app.errorhandler(HTTPException)
+def handle_http_error(e: HTTPException):
+    # Keep abort()/413/415 status codes instead of falling through to the 500 handler
+    return jsonify(error=e.description), e.code
+
+@app.errorhandler(PublishThrottled)
+def handle_throttled(e: PublishThrottled):
+    return jsonify(ok=False, error=str(e)), e.status, {"Retry-After": str(e.retry_after)}
+
 @app.get("/healthz")
 def healthz():
+    # Normally answered by HealthzMiddleware; kept for url_for/test clients
     return jsonify(ok=True)
 
+def _json_body(allow_list: bool = False) -> Any:
+    """Parsed JSON object (or array, if allowed) body; 415 if not sent as JSON, 400 if malformed."""
+    if not request.is_json:
+        abort(415, "Content-Type must be application/json")
+    payload = request.get_json(silent=True)
+    if payload is None and request.content_length:
+        app.logger.warning("Error 400: Request body must be valid JSON")
+        abort(400, "Request body must be valid JSON")
+    if payload is not None and not isinstance(payload, dict) and not (allow_list and isinstance(payload, list)):
+        abort(400, "Request body must be a JSON object")
+    return payload or {}
+
 # ---------------- Drafts ----------------
-@app.post("/drafts")
-def create_draft():
-    # Read JSON (force=True allows unknown content-type as long as body is JSON)
+def _ingest_media_job(post_id: str, media_inline: Optional[Dict[str, Any]],
+                      media_data_url: Optional[str], caption: str) -> None:
+    """Background: upload the draft's media to S3, then finalize the draft."""
     try:
-        payload = request.get_json(force=True) or {}
+        try:
+            if media_inline:
+                s3_key, _mime = ingest_inline_media(
+                    mime=media_inline.get("mime", "image/svg+xml"),
+                    content=media_inline.get("content", ""),
+                    encoding=media_inline.get("encoding", "utf8"),
+                    caption_hint=caption,
+                    post_id=post_id,
+                )
+            else:
+                s3_key, _mime = ingest_data_url_to_s3(media_data_url, caption_hint=caption, post_id=post_id)
+        except Exception as e:
+            app.logger.warning("media ingestion failed for %s: %s", post_id, e)
+            finish_ingest(post_id, error=str(e))
+            return
+        finish_ingest(post_id, media_s3_key=s3_key)
     except Exception:
-        app.logger.warning("Error 400: Request body must be valid JSON")
-        abort(400, "Request body must be valid JSON")
+        app.logger.error("ingest job crashed for %s", post_id, exc_info=True)
 
+def _prepare_draft(payload: Dict[str, Any]):
+    """
+    Build a draft from a /drafts payload. Returns (draft, media_inline, media_data_url);
+    when either media value is set the draft is stored as "ingesting" and the
+    caller must submit _ingest_media_job after add_draft. Raises MediaError if a
+    plain media_url fails its probe.
+    """
     caption = (payload.get("caption") or "").strip()
     if not caption:
         abort(400, "caption is required")
@@ -62,8 +188,8 @@ def create_draft():
     draft: Dict[str, Any] = {
         "caption": caption,
         "media_url": payload.get("media_url") or None,           # optional HTTPS URL
-        "media_type": (payload.get("media_type") or "image").lower(),
-        "platforms": payload.get("platforms") or ["instagram", "facebook"],
+        "media_type": payload.get("media_type"),        # normalized by add_draft
+        "platforms": payload.get("platforms"),
         "source": payload.get("source") or "unknown",
         "notes": payload.get("notes") or "",
     }
@@ -75,32 +201,157 @@ def create_draft():
     media_inline = payload.get("media_inline")
     media_data_url = payload.get("media_data_url")
 
+    if isinstance(media_inline, dict) and media_inline.get("content"):
+        media_data_url = None
+    elif isinstance(media_data_url, str) and media_data_url.strip():
+        media_inline = None
+    else:
+        # media_url stays as-is (checked here so bad URLs fail before Graph) or text-only;
+        # on text posts it is a plain link, not media, so it isn't probed
+        media_type = draft["media_type"]
+        is_text = isinstance(media_type, str) and media_type.lower().strip() == "text"
+        if draft["media_url"] and not is_text:
+            probe_media_url(draft["media_url"])
+        return draft, None, None
+
+    # Media is finalized in the background; poll /debug/post?id=... until the
+    # status leaves "ingesting" (→ "pending", or "ingest_failed" with history).
+    draft["status"] = "ingesting"
+    draft["media_url"] = None
+    draft["media_type"] = "image"  # we render SVG → PNG
+    return draft, media_inline, media_data_url
+
+def _inline_media_size(payload: Dict[str, Any]) -> int:
+    """Length of a draft payload's media_inline content or media_data_url."""
+    media_inline = payload.get("media_inline")
+    if isinstance(media_inline, dict) and isinstance(media_inline.get("content"), str):
+        return len(media_inline["content"])
+    media_data_url = payload.get("media_data_url")
+    return len(media_data_url) if isinstance(media_data_url, str) else 0
+
+@app.post("/drafts")
+def create_draft():
+    if request.content_length is not None and request.content_length > MAX_INLINE_BYTES:
+        return jsonify(ok=False, error=f"request body exceeds {MAX_INLINE_BYTES} bytes"), 413
+
+    payload = _json_body()
     try:
-        if isinstance(media_inline, dict) and media_inline.get("content"):
-            s3_key, _mime = ingest_inline_media(
-                mime=media_inline.get("mime", "image/svg+xml"),
-                content=media_inline.get("content", ""),
-                encoding=media_inline.get("encoding", "utf8"),
-                caption_hint=caption,
-            )
-            draft["media_s3_key"] = s3_key
-            draft["media_url"] = None
-            draft["media_type"] = "image"  # we render SVG → PNG
-        elif isinstance(media_data_url, str) and media_data_url.strip():
-            s3_key, _mime = ingest_data_url_to_s3(media_data_url, caption_hint=caption)
-            draft["media_s3_key"] = s3_key
-            draft["media_url"] = None
-            draft["media_type"] = "image"
-        # else: media_url stays as-is or text-only if none provided
-    except Exception as e:
-        return jsonify(ok=False, error=f"media ingestion failed: {e}"), 400
+        draft, media_inline, media_data_url = _prepare_draft(payload)
+    except MediaError as e:
+        return jsonify(ok=False, error=f"media_url check failed: {e}"), 400
 
     post_id = add_draft(draft)
-    return jsonify(ok=True, post_id=post_id)
+    if media_inline is None and media_data_url is None:
+        return jsonify(ok=True, post_id=post_id)
+    INGEST_POOL.submit(_ingest_media_job, post_id, media_inline, media_data_url, draft["caption"])
+    return jsonify(ok=True, post_id=post_id, status="ingesting"), 202
+
+@app.post("/drafts/bulk")
+def create_drafts_bulk():
+    """Create many drafts at once: a JSON array (or {"drafts": [...]}) of /drafts payloads."""
+    body = _json_body(allow_list=True)
+    items = body.get("drafts") if isinstance(body, dict) else body
+    if not isinstance(items, list) or not items or not all(isinstance(i, dict) for i in items):
+        abort(400, "body must be a non-empty list of draft objects")
+
+    # Same per-draft inline media limit as /drafts (which checks its whole body)
+    for n, item in enumerate(items):
+        if _inline_media_size(item) > MAX_INLINE_BYTES:
+            return jsonify(ok=False, index=n, error=f"inline media exceeds {MAX_INLINE_BYTES} bytes"), 413
+
+    # Validate everything before writing anything; media_url probes are network
+    # round trips, so run them on a small pool instead of one after another
+    def prepare(item: Dict[str, Any]):
+        try:
+            return _prepare_draft(item), None
+        except MediaError as e:
+            return None, e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(BULK_PROBE_WORKERS, len(items)))) as ex:
+        results = list(ex.map(prepare, items))
+    prepared = []
+    for n, (draft_parts, err) in enumerate(results):
+        if err is not None:
+            return jsonify(ok=False, index=n, error=f"media_url check failed: {err}"), 400
+        prepared.append(draft_parts)
+
+    with buffered_drafts() as failed:
+        post_ids = [add_draft(draft) for draft, _inline, _data_url in prepared]
+
+    # Writes are independent: report the ones that landed alongside the ones that didn't
+    stored, ingesting = [], False
+    for post_id, (draft, media_inline, media_data_url) in zip(post_ids, prepared):
+        if post_id in failed:
+            continue
+        stored.append(post_id)
+        if media_inline is not None or media_data_url is not None:
+            ingesting = True
+            INGEST_POOL.submit(_ingest_media_job, post_id, media_inline, media_data_url, draft["caption"])
+    errors = [
+        {"index": n, "post_id": post_id, "error": failed[post_id]}
+        for n, post_id in enumerate(post_ids) if post_id in failed
+    ]
+    if errors:
+        app.logger.error("bulk draft writes failed: %s", errors)
+        return jsonify(ok=False, post_ids=stored, errors=errors), (207 if stored else 502)
+    return jsonify(ok=True, post_ids=stored), (202 if ingesting else 200)
+
+# Shared helpers
+def _with_media_url(post: Dict[str, Any]) -> Dict[str, Any]:
+    """Resolve an S3-hosted asset to a (cached) presigned URL once, before fan-out."""
+    if post.get("media_url") or not post.get("media_s3_key"):
+        return post
+    return {**post, "media_url": get_media_url(post["media_s3_key"])}
+
+def _reserve_daily_slot(channel: str) -> bool:
+    """Check the channel's rolling 24h cap and reserve a slot. False if no cap applies."""
+    limit = DAILY_POST_LIMITS.get(channel) or 0
+    if not limit:
+        return False
+    with _CAP_LOCK:
+        seen = _CAP_RECORDED[channel]
+    recent = recent_post_count(channel, fresh=True)  # S3 round trips: not under the lock
+    with _CAP_LOCK:
+        # Publishes recorded since the count started may be missing from it
+        recent += _CAP_RECORDED[channel] - seen
+        if recent + _CAP_INFLIGHT[channel] >= limit:
+            raise PublishThrottled(f"{channel} daily post limit ({limit}) reached", status=429, retry_after=3600)
+        _CAP_INFLIGHT[channel] += 1
+    return True
+
+def _publish_to_channel(channel: str, post: Dict[str, Any]) -> Any:
+    """Publish a single post to one channel ("facebook" | "instagram") and record it."""
+    if not PUBLISH_SEM.acquire(timeout=PUBLISH_WAIT_S):
+        raise PublishThrottled("too many concurrent publishes, retry shortly")
+    try:
+        reserved = _reserve_daily_slot(channel)
+        recorded = False
+        try:
+            publish = meta_client.publish_facebook if channel == "facebook" else meta_client.publish_instagram
+            res = publish(
+                caption=post["caption"],
+                media_url=post.get("media_url"),
+                media_type=post.get("media_type") or "image",
+                media_s3_key=post.get("media_s3_key"),
+            )
+            mark_posted(post["id"], channel)
+            recorded = True
+            return res
+        finally:
+            if reserved:
+                with _CAP_LOCK:
+                    _CAP_INFLIGHT[channel] -= 1
+                    if recorded:
+                        _CAP_RECORDED[channel] += 1
+    finally:
+        PUBLISH_SEM.release()
 
-# Shared helper
 def _approve_and_maybe_publish(post_id: str, publish_now: bool, channels: Optional[List[str]]):
-    if not approve_post(post_id):
+    try:
+        approved = approve_post(post_id)
+    except PostNotReady as e:
+        abort(409, str(e))
+    if not approved:
         abort(404, f"post_id {post_id} not found")
 
     published: Dict[str, Any] = {}
@@ -110,29 +361,35 @@ def _approve_and_maybe_publish(post_id: str, publish_now: bool, channels: Option
             abort(404, f"post_id {post_id} not found after approve")
 
         targets = channels or post.get("platforms") or ["instagram", "facebook"]
-        for ch in targets:
-            ch = (ch or "").lower().strip()
-            try:
-                if ch == "facebook":
-                    res = meta_client.publish_facebook(
-                        caption=post["caption"],
-                        media_url=post.get("media_url"),
-                        media_type=post.get("media_type") or "image",
-                        media_s3_key=post.get("media_s3_key"),
-                    )
-                elif ch == "instagram":
-                    res = meta_client.publish_instagram(
-                        caption=post["caption"],
-                        media_url=post.get("media_url"),
-                        media_type=post.get("media_type") or "image",
-                        media_s3_key=post.get("media_s3_key"),
-                    )
-                else:
-                    continue
-                mark_posted(post_id, ch)
-                published[ch] = {"ok": True, "response": res}
-            except Exception as e:
-                published[ch] = {"ok": False, "error": str(e)}
+        targets = [ch for ch in dict.fromkeys((ch or "").lower().strip() for ch in targets)
+                   if ch in ("facebook", "instagram")]
+        try:
+            post = _with_media_url(post)
+        except Exception as e:
+            # The approval is already persisted: report the failure per channel, don't 500
+            app.logger.warning("presign failed for %s: %s", post_id, e)
+            published = {ch: {"ok": False, "error": f"media_url unavailable: {e}"} for ch in targets}
+            targets = []
+        if targets:
+            # Channels are independent: overlap the Graph round trips so latency
+            # is max(fb, ig) instead of fb + ig. Concurrent mark_posted calls on
+            # the same post are safe (conditional writes retry and re-apply).
+            throttled: List[PublishThrottled] = []
+            with ThreadPoolExecutor(max_workers=len(targets)) as ex:
+                futures = {ex.submit(_publish_to_channel, ch, post): ch for ch in targets}
+                for fut in as_completed(futures):
+                    ch = futures[fut]
+                    try:
+                        res = fut.result()
+                        published[ch] = {"ok": True, "response": res}
+                    except PublishThrottled as e:
+                        throttled.append(e)
+                        published[ch] = {"ok": False, "error": str(e)}
+                    except Exception as e:
+                        published[ch] = {"ok": False, "error": str(e)}
+            # Nothing went out: let the caller retry (approval itself is idempotent)
+            if len(throttled) == len(targets):
+                raise throttled[0]
 
     return {"ok": True, "post_id": post_id, "published": published}
 
@@ -143,13 +400,13 @@ def approve_link():
         abort(400, "post_id is required")
     publish_now = _bool(request.args.get("publish_now"), False)
     channels = request.args.get("channels")
-    channels = [c.strip() for c in channels.split(",")] if channels else None
+    channels = channels.split(",") if channels else None
     result = _approve_and_maybe_publish(post_id, publish_now, channels)
     return jsonify(result)
 
 @app.post("/approve")
 def approve_api():
-    data = request.get_json(force=True) or {}
+    data = _json_body()
     post_id = data.get("post_id")
     if not post_id:
         abort(400, "post_id is required")
@@ -159,36 +416,85 @@ def approve_api():
     return jsonify(result)
 
 # ---------------- Scheduler ----------------
+def _run_slot(slot: str):
+    """Pick and publish the next post for today's slot. Returns (body, http_status)."""
+    channel = slot_channel_for_today(slot)
+    post = pick_next_for_channel(channel)
+    if not post:
+        return {"ok": False, "reason": f"No approved content for {channel}"}, 200
+
+    try:
+        res = _publish_to_channel(channel, _with_media_url(post))
+        return {"ok": True, "channel": channel, "post_id": post["id"], "response": res}, 200
+    except PublishThrottled:
+        raise
+    except Exception as e:
+        return {"ok": False, "channel": channel, "post_id": post["id"], "error": str(e)}, 500
+
+def _execute_job(job: Dict[str, Any]) -> None:
+    save_job({**job, "status": "running", "started_at": time.time()})
+    try:
+        body, _code = _run_slot(job["slot"])
+        status = "done" if body.get("ok") else "failed"
+    except PublishThrottled as e:
+        body, status = {"ok": False, "error": str(e), "retry_after": e.retry_after}, "failed"
+    except Exception as e:
+        app.logger.error("scheduler job %s crashed", job["id"], exc_info=True)
+        body, status = {"ok": False, "error": str(e)}, "failed"
+    save_job({**job, "status": status, "finished_at": time.time(), "result": body})
+
+def _job_worker() -> None:
+    while True:
+        job = JOB_QUEUE.get()
+        try:
+            _execute_job(job)
+        except Exception:
+            app.logger.error("failed to record scheduler job %s", job.get("id"), exc_info=True)
+        finally:
+            JOB_QUEUE.task_done()
+
+def _ensure_job_worker() -> None:
+    """Start this process's worker thread on first use (once per gunicorn worker)."""
+    global _worker_pid
+    pid = os.getpid()
+    if _worker_pid == pid:
+        return
+    with _worker_lock:
+        if _worker_pid != pid:
+            threading.Thread(target=_job_worker, name="scheduler-worker", daemon=True).start()
+            _worker_pid = pid
+
 @app.post("/scheduler/run")
 def run_scheduler():
     slot = (request.args.get("slot") or "am").lower()
     if slot not in ("am", "pm"):
         abort(400, "slot must be am or pm")
 
-    channel = slot_channel_for_today(slot)
-    post = pick_next_for_channel(channel)
-    if not post:
-        return jsonify(ok=False, reason=f"No approved content for {channel}"), 200
+    if not WORKER_INLINE:
+        body, code = _run_slot(slot)
+        return jsonify(body), code
 
-    try:
-        if channel == "facebook":
-            res = meta_client.publish_facebook(
-                caption=post["caption"],
-                media_url=post.get("media_url"),
-                media_type=post.get("media_type") or "image",
-                media_s3_key=post.get("media_s3_key"),
-            )
-        else:
-            res = meta_client.publish_instagram(
-                caption=post["caption"],
-                media_url=post.get("media_url"),
-                media_type=post.get("media_type") or "image",
-                media_s3_key=post.get("media_s3_key"),
-            )
-        mark_posted(post["id"], channel)
-        return jsonify(ok=True, channel=channel, post_id=post["id"], response=res)
-    except Exception as e:
-        return jsonify(ok=False, channel=channel, post_id=post["id"], error=str(e)), 500
+    job = {"id": f"job_{uuid.uuid4().hex[:16]}", "slot": slot, "requested_at": time.time(), "status": "queued"}
+    save_job(job)
+    _ensure_job_worker()
+    JOB_QUEUE.put(job)
+    return jsonify(ok=True, job_id=job["id"], status="queued"), 202
+
+@app.get("/scheduler/status")
+def scheduler_status():
+    job_id = request.args.get("id")
+    if not job_id:
+        abort(400, "id is required")
+    job = get_job(job_id)
+    if not job:
+        return jsonify(ok=False, error=f"job {job_id} not found"), 404
+    if job.get("status") in ("queued", "running"):
+        since = job.get("started_at") or job.get("requested_at") or 0
+        if time.time() - since > JOB_STALE_S:
+            # Its worker went away before finishing; record that so callers stop polling
+            job = {**job, "status": "stale", "result": {"ok": False, "error": "worker lost before job finished"}}
+            save_job(job)
+    return jsonify(job)
 
 # ---------------- Debug (optional) ----------------
 @app.get("/debug/post")
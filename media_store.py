@@ -2,16 +2,42 @@ from __future__ import annotations
 
 import base64
 import binascii
+import ipaddress
 import os
 import re
+import socket
+import tempfile
+import threading
 import time
+import uuid
 from datetime import datetime, timezone
-from typing import Optional, Tuple
-from urllib.parse import unquote_to_bytes
+from typing import BinaryIO, Optional, Tuple
+from urllib.parse import unquote_to_bytes, urljoin, urlsplit
 
 import boto3
+import requests
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from cachetools import TTLCache
 
-S3 = boto3.client("s3")
+S3 = boto3.client("s3", config=Config(
+    max_pool_connections=20,
+    retries={"mode": "adaptive", "max_attempts": 3},
+    tcp_keepalive=True,
+    connect_timeout=3,
+    read_timeout=30,
+    s3={"addressing_style": "virtual"},
+))
+
+# Multipart upload in 8MB parts; decoded media spills to disk past SPOOL_MAX_BYTES.
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=5 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    use_threads=True,
+)
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+B64_CHUNK_CHARS = 64 * 1024  # multiple of 4
+B64_NON_ALPHABET_RE = re.compile(r"[^A-Za-z0-9+/=]+")
 
 # Accepts any number of ;params (e.g., ;utf8, ;charset=utf-8, ;name=foo, ;base64)
 DATAURL_RE = re.compile(
@@ -22,6 +48,13 @@ DATAURL_RE = re.compile(
 class MediaError(RuntimeError):
     pass
 
+# Remote media_url probes: successful results are cached for an hour.
+MAX_REMOTE_MEDIA_BYTES = 100 * 1024 * 1024
+_PROBE_CACHE: "TTLCache[str, Tuple[str, Optional[int]]]" = TTLCache(maxsize=512, ttl=3600)
+_PROBE_LOCK = threading.Lock()
+_HTTP = requests.Session()
+PROBE_MAX_REDIRECTS = 5
+
 def _now_ts() -> str:
     return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
 
@@ -37,11 +70,14 @@ def _media_prefix() -> str:
     prefix = os.getenv("MEDIA_S3_PREFIX", "social/generated/")
     return prefix if prefix.endswith("/") else prefix + "/"
 
-def s3_key_for_media(caption_hint: str, ext: str = ".png") -> str:
+def s3_key_for_media(caption_hint: str, ext: str = ".png", post_id: str = "") -> str:
+    # Slug + second-resolution timestamp alone collide for similar captions ingested
+    # together (bulk drafts), so always end with the post id or a random tag.
     slug = _slug(caption_hint or "media")
     yyyy = datetime.now(timezone.utc).strftime("%Y")
     mm = datetime.now(timezone.utc).strftime("%m")
-    return f"{_media_prefix()}{yyyy}/{mm}/trusect-{slug}-{_now_ts()}{ext}"
+    tag = re.sub(r"[^A-Za-z0-9_-]+", "", post_id or "") or uuid.uuid4().hex[:12]
+    return f"{_media_prefix()}{yyyy}/{mm}/trusect-{slug}-{_now_ts()}-{tag}{ext}"
 
 def upload_bytes_to_s3(body: bytes, content_type: str, key: str) -> str:
     bucket = _media_bucket()
@@ -50,6 +86,18 @@ def upload_bytes_to_s3(body: bytes, content_type: str, key: str) -> str:
     S3.put_object(Bucket=bucket, Key=key, Body=body, ContentType=content_type)
     return key
 
+def upload_fileobj_to_s3(fileobj: BinaryIO, content_type: str, key: str) -> str:
+    bucket = _media_bucket()
+    if not bucket:
+        raise MediaError("MEDIA_S3_BUCKET or QUEUE_S3_BUCKET must be set")
+    fileobj.seek(0)
+    S3.upload_fileobj(
+        fileobj, bucket, key,
+        ExtraArgs={"ContentType": content_type},
+        Config=TRANSFER_CONFIG,
+    )
+    return key
+
 def presign_s3(key: str, expires: int = 3600) -> str:
     bucket = _media_bucket()
     if not bucket:
@@ -60,6 +108,85 @@ def presign_s3(key: str, expires: int = 3600) -> str:
         ExpiresIn=expires,
     )
 
+def _check_public_https(url: str) -> None:
+    """
+    Only probe https URLs whose host resolves to public addresses, so the probe
+    can't be aimed at internal services (metadata endpoint, VPC hosts, localhost).
+    """
+    parts = urlsplit(url)
+    if parts.scheme != "https" or not parts.hostname:
+        raise MediaError("media_url must be an https URL")
+    try:
+        infos = socket.getaddrinfo(parts.hostname, parts.port or 443, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        raise MediaError("media_url host does not resolve")
+    for info in infos:
+        if not ipaddress.ip_address(info[4][0].split("%")[0]).is_global:
+            raise MediaError("media_url host is not allowed")
+
+def _probe_request(url: str, timeout: float) -> requests.Response:
+    """HEAD (GET if refused), following redirects by hand so each hop is checked."""
+    for _hop in range(PROBE_MAX_REDIRECTS + 1):
+        _check_public_https(url)
+        resp = _HTTP.head(url, timeout=timeout, allow_redirects=False)
+        if resp.status_code in (403, 405, 501):
+            # Some CDNs refuse HEAD; a streamed GET only reads the headers
+            resp = _HTTP.get(url, timeout=timeout, allow_redirects=False, stream=True)
+            resp.close()
+        if not resp.is_redirect:
+            return resp
+        url = urljoin(url, resp.headers.get("Location") or "")
+    raise MediaError("media_url redirects too many times")
+
+def probe_media_url(url: str, timeout: float = 3.0) -> Tuple[str, Optional[int]]:
+    """
+    HEAD-check a remote media URL before handing it to Graph.
+    Returns (content_type, content_length or None); raises MediaError if the URL
+    is not public https (checked on every redirect), unreachable, not image/* or
+    video/*, or larger than MAX_REMOTE_MEDIA_BYTES.
+    """
+    with _PROBE_LOCK:
+        hit = _PROBE_CACHE.get(url)
+    if hit is not None:
+        return hit
+    try:
+        resp = _probe_request(url, timeout)
+    except requests.RequestException as e:
+        raise MediaError(f"media_url unreachable: {e}")
+    if not resp.ok:
+        raise MediaError(f"media_url returned HTTP {resp.status_code}")
+    ctype = (resp.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+    if not ctype.startswith(("image/", "video/")):
+        raise MediaError(f"media_url content type is not image/video: {ctype or 'unknown'}")
+    length_hdr = resp.headers.get("Content-Length")
+    length = int(length_hdr) if length_hdr and length_hdr.isdigit() else None
+    if length is not None and length > MAX_REMOTE_MEDIA_BYTES:
+        raise MediaError(f"media_url is too large ({length} bytes)")
+    with _PROBE_LOCK:
+        _PROBE_CACHE[url] = (ctype, length)
+    return ctype, length
+
+# Presigned GET URLs per S3 key. Entries are evicted PRESIGN_MIN_TTL_S before the
+# URL expires, so a cached URL always has at least that long left.
+PRESIGN_EXPIRES_S = 3600
+PRESIGN_MIN_TTL_S = 300
+_presign_cache: "TTLCache[str, str]" = TTLCache(maxsize=1024, ttl=PRESIGN_EXPIRES_S - PRESIGN_MIN_TTL_S)
+_presign_lock = threading.Lock()
+
+def get_media_url(s3_key: str) -> str:
+    """
+    Presigned URL for a media object, cached per key so a publish to several
+    channels (and retries within the hour) hand Meta the same URL.
+    """
+    with _presign_lock:
+        url = _presign_cache.get(s3_key)
+    if url:
+        return url
+    url = presign_s3(s3_key, expires=PRESIGN_EXPIRES_S)
+    with _presign_lock:
+        _presign_cache[s3_key] = url
+    return url
+
 # ---------- Parsers & Converters ----------
 
 def parse_data_url(data_url: str) -> Tuple[str, bytes]:
@@ -91,15 +218,45 @@ def parse_data_url(data_url: str) -> Tuple[str, bytes]:
     else:
         return mime, unquote_to_bytes(raw)
 
+def b64decode_to_file(content: str) -> BinaryIO:
+    """
+    Decode base64 text in fixed-size chunks into a spooled temp file, so the
+    decoded bytes never exist as one in-memory string alongside the input.
+    Characters outside the base64 alphabet (whitespace, stray symbols) are
+    dropped before alignment, matching b64decode(validate=False).
+    """
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    carry = ""
+    try:
+        for i in range(0, len(content), B64_CHUNK_CHARS):
+            piece = carry + B64_NON_ALPHABET_RE.sub("", content[i:i + B64_CHUNK_CHARS])
+            cut = len(piece) - (len(piece) % 4)
+            out.write(base64.b64decode(piece[:cut]))
+            carry = piece[cut:]
+        if carry:
+            out.write(base64.b64decode(carry))
+    except (binascii.Error, ValueError) as e:
+        out.close()
+        raise MediaError(f"Invalid base64 content: {e}")
+    out.seek(0)
+    return out
+
+def _passthrough_mime(mime_in: str) -> Optional[str]:
+    """Return the normalized output mime for PNG/JPEG inputs, None if conversion is needed."""
+    mi = (mime_in or "").lower()
+    if mi in ("image/png", "image/jpeg", "image/jpg"):
+        return "image/jpeg" if mi == "image/jpg" else mi
+    return None
+
 def ensure_png_or_jpeg(mime_in: str, blob: bytes, target_px: Optional[int] = 1080) -> Tuple[bytes, str]:
     """
     Convert SVG → PNG (requires cairosvg). Pass-through PNG/JPEG.
     Returns (bytes_out, mime_out).
     """
-    mi = (mime_in or "").lower()
-    if mi in ("image/png", "image/jpeg", "image/jpg"):
-        return blob, ("image/jpeg" if mi == "image/jpg" else mi)
-    if mi == "image/svg+xml":
+    passthrough = _passthrough_mime(mime_in)
+    if passthrough:
+        return blob, passthrough
+    if (mime_in or "").lower() == "image/svg+xml":
         try:
             import cairosvg  # lazy import so app can boot even if not installed
         except ImportError as e:
@@ -110,7 +267,7 @@ def ensure_png_or_jpeg(mime_in: str, blob: bytes, target_px: Optional[int] = 108
 
 # ---------- Ingestion Entry Points ----------
 
-def ingest_data_url_to_s3(data_url: str, caption_hint: str = "") -> Tuple[str, str]:
+def ingest_data_url_to_s3(data_url: str, caption_hint: str = "", post_id: str = "") -> Tuple[str, str]:
     """
     Accepts a data: URL (png/jpeg/svg), converts if needed, uploads to S3.
     Returns (s3_key, mime_out).
@@ -118,21 +275,30 @@ def ingest_data_url_to_s3(data_url: str, caption_hint: str = "") -> Tuple[str, s
     mime_in, blob = parse_data_url(data_url)
     bytes_out, mime_out = ensure_png_or_jpeg(mime_in, blob, target_px=1080)
     ext = ".png" if mime_out == "image/png" else ".jpg"
-    key = s3_key_for_media(caption_hint, ext=ext)
+    key = s3_key_for_media(caption_hint, ext=ext, post_id=post_id)
     upload_bytes_to_s3(bytes_out, mime_out, key)
     return key, mime_out
 
-def ingest_inline_media(mime: str, content: str, encoding: str = "utf8", caption_hint: str = "") -> Tuple[str, str]:
+def ingest_inline_media(mime: str, content: str, encoding: str = "utf8", caption_hint: str = "",
+                        post_id: str = "") -> Tuple[str, str]:
     """
     Accepts inline media provided in JSON:
       - mime: "image/svg+xml" | "image/png" | "image/jpeg"
       - encoding: "utf8" (text) or "base64"
       - content: the string payload
     Converts SVG→PNG, uploads, returns (s3_key, mime_out).
+    Base64 PNG/JPEG is decoded in chunks and streamed to S3 (multipart when large).
     """
     if not isinstance(mime, str) or not isinstance(content, str):
         raise MediaError("inline media must include string 'mime' and 'content'")
     enc = (encoding or "utf8").lower()
+    passthrough = _passthrough_mime(mime)
+    if passthrough and enc in ("base64", "b64"):
+        ext = ".png" if passthrough == "image/png" else ".jpg"
+        key = s3_key_for_media(caption_hint, ext=ext, post_id=post_id)
+        with b64decode_to_file(content) as fh:
+            upload_fileobj_to_s3(fh, passthrough, key)
+        return key, passthrough
     if enc in ("utf8", "utf-8", "text", "plain"):
         blob = content.encode("utf-8")
     elif enc in ("base64", "b64"):
@@ -145,7 +311,7 @@ def ingest_inline_media(mime: str, content: str, encoding: str = "utf8", caption
 
     bytes_out, mime_out = ensure_png_or_jpeg(mime, blob, target_px=1080)
     ext = ".png" if mime_out == "image/png" else ".jpg"
-    key = s3_key_for_media(caption_hint, ext=ext)
+    key = s3_key_for_media(caption_hint, ext=ext, post_id=post_id)
     upload_bytes_to_s3(bytes_out, mime_out, key)
     return key, mime_out
 
@@ -3,7 +3,7 @@
 # Functions expected by app.py:
 #   ig_create_image_container(image_url, caption) -> creation_id
 #   ig_create_video_container(video_url, caption, reels=False, share_to_feed=None, cover_url=None) -> creation_id
-#   ig_poll_container(creation_id, timeout_sec=300, interval_sec=5) -> None
+#   ig_poll_container(creation_id, timeout_sec=300, max_interval_sec=15) -> None
 #   ig_publish_from_container(creation_id) -> media_id
 #   fb_create_text_post(message, link=None, scheduled_unix=None) -> post_id
 #   fb_create_photo_post(image_url, caption=None, scheduled_unix=None) -> post_id
@@ -17,16 +17,23 @@
 #   FB_PAGE_ACCESS_TOKEN     (Page Access Token w/ pages_manage_posts)
 #
 # Notes:
-# - All requests use a short timeout and minimal retry/backoff.
+# - All requests use a short timeout and minimal retry/backoff: 4xx fail fast
+#   unless Graph flags them as throttling/transient (error code 4/17/32/613 or
+#   is_transient), 429/503 honor Retry-After, and other retryable errors back
+#   off exponentially.
+# - Requests share one pooled Session per process (keep-alive to graph.facebook.com).
 # - For FB scheduled posts, scheduled_unix is a UNIX timestamp (seconds).
 # - Instagram containers expire (~24h); only create after human approval.
 
 import os
+import random
 import time
 import logging
+import threading
 from typing import Optional, Dict, Any, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 
 LOG = logging.getLogger("meta-client")
 LOG.setLevel(logging.INFO)
@@ -42,6 +49,17 @@ GRAPH = f"https://graph.facebook.com/{API_VER}"
 DEFAULT_TIMEOUT = float(os.getenv("HTTP_TIMEOUT_S", "20"))
 RETRY_COUNT = int(os.getenv("HTTP_RETRIES", "3"))
 RETRY_BACKOFF_S = float(os.getenv("HTTP_RETRY_BACKOFF_S", "1.5"))
+MAX_RETRY_AFTER_S = float(os.getenv("HTTP_MAX_RETRY_AFTER_S", "60"))
+# Graph reports rate limiting as HTTP 400/403 with these error codes:
+# 4 app-level, 17 user-level, 32 page-level, 613 custom rate limit.
+GRAPH_THROTTLE_CODES = frozenset({4, 17, 32, 613})
+POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "32"))
+
+# Shared HTTP session, created lazily so each gunicorn worker gets its own
+# connection pool after fork (sockets must not be shared across processes).
+_SESSION: Optional[requests.Session] = None
+_SESSION_PID: Optional[int] = None
+_SESSION_LOCK = threading.Lock()
 
 
 class MetaError(RuntimeError):
@@ -62,10 +80,42 @@ def _check_env() -> None:
         raise MetaError(f"Missing required environment variables: {', '.join(missing)}")
 
 
+def _session() -> requests.Session:
+    """Return the process-wide pooled Session, (re)creating it after a fork."""
+    global _SESSION, _SESSION_PID
+    pid = os.getpid()
+    if _SESSION is not None and _SESSION_PID == pid:
+        return _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None or _SESSION_PID != pid:
+            sess = requests.Session()
+            # Retries are handled explicitly in _request (richer Graph error parsing).
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+            sess.mount("https://", adapter)
+            _SESSION = sess
+            _SESSION_PID = pid
+    return _SESSION
+
+
+def _retry_after_s(resp: requests.Response) -> Optional[float]:
+    """Parse a numeric Retry-After header (seconds), capped at MAX_RETRY_AFTER_S."""
+    raw = resp.headers.get("Retry-After")
+    if not raw:
+        return None
+    try:
+        return min(max(float(raw), 0.0), MAX_RETRY_AFTER_S)
+    except ValueError:
+        return None  # HTTP-date form; fall back to exponential backoff
+
+
+def _backoff_s(attempt: int) -> float:
+    return RETRY_BACKOFF_S * (2 ** (attempt - 1)) + random.uniform(0, 0.5)
+
+
 def _request(method: str, url: str, *, params: Dict[str, Any] = None,
              data: Dict[str, Any] = None, files: Dict[str, Any] = None) -> Dict[str, Any]:
     """
-    Small wrapper around requests with simple retries/backoff.
+    Small wrapper around the shared Session with simple retries/backoff.
     Sends form-encoded data (Graph API prefers form fields).
     """
     params = params or {}
@@ -73,8 +123,9 @@ def _request(method: str, url: str, *, params: Dict[str, Any] = None,
 
     last_err: Optional[Exception] = None
     for attempt in range(1, RETRY_COUNT + 1):
+        delay: Optional[float] = None
         try:
-            resp = requests.request(
+            resp = _session().request(
                 method.upper(),
                 url,
                 params=params,
@@ -96,15 +147,20 @@ def _request(method: str, url: str, *, params: Dict[str, Any] = None,
             fbtrace = err.get("fbtrace_id")
             LOG.warning("Graph API error %s %s: %s (code=%s type=%s fbtrace=%s)",
                         method.upper(), url, message, code, type_, fbtrace)
-            # Non-200: raise to trigger retry or bubble up
             last_err = MetaError(f"{resp.status_code}: {message}")
+            retryable = code in GRAPH_THROTTLE_CODES or bool(err.get("is_transient"))
+            # Permanent client errors: retrying won't help
+            if resp.status_code < 500 and resp.status_code != 429 and not retryable:
+                raise last_err
+            if resp.status_code in (429, 503):
+                delay = _retry_after_s(resp)
         except requests.RequestException as e:
             last_err = e
             LOG.warning("HTTP error (%s %s) attempt %d/%d: %s",
                         method.upper(), url, attempt, RETRY_COUNT, e)
 
         if attempt < RETRY_COUNT:
-            time.sleep(RETRY_BACKOFF_S * attempt)
+            time.sleep(delay if delay is not None else _backoff_s(attempt))
 
     assert last_err is not None
     raise MetaError(f"Request failed after {RETRY_COUNT} attempts: {last_err}")
@@ -169,9 +225,16 @@ def ig_create_video_container(
     return creation_id
 
 
-def ig_poll_container(creation_id: str, timeout_sec: int = 300, interval_sec: int = 5) -> None:
+# Poll schedule (seconds): quick early checks for short uploads, then back off.
+POLL_INTERVALS_S = (1, 2, 3, 5, 8, 13)
+_TERMINAL_BAD = frozenset({"ERROR", "EXPIRED"})
+
+
+def ig_poll_container(creation_id: str, timeout_sec: int = 300, max_interval_sec: int = 15) -> None:
     """
-    Poll the container until status_code == FINISHED or timeout.
+    Poll the container until status_code is FINISHED; fail fast on ERROR/EXPIRED
+    and on PUBLISHED (the container was already consumed).
+    Intervals grow along POLL_INTERVALS_S and then stay at max_interval_sec.
     Containers expire (~24h); create just-in-time after approval.
     """
     _check_env()
@@ -180,15 +243,28 @@ def ig_poll_container(creation_id: str, timeout_sec: int = 300, interval_sec: in
         "fields": "status_code,status",
         "access_token": IG_TOKEN,
     }
-    waited = 0
-    while waited <= timeout_sec:
+    sleep, monotonic = time.sleep, time.monotonic
+    deadline = monotonic() + timeout_sec
+    attempt = 0
+    while True:
         j = _request("GET", url, params=params)
-        status_code = j.get("status_code") or j.get("status")
-        if str(status_code).upper() == "FINISHED":
+        status_code = str(j.get("status_code") or "").upper()
+        status = str(j.get("status") or "")
+        if status_code == "FINISHED":
             LOG.info("IG container ready: %s", creation_id)
             return
-        time.sleep(interval_sec)
-        waited += interval_sec
+        # A PUBLISHED container was already used; media_publish on it would fail or double-post
+        if status_code == "PUBLISHED":
+            raise MetaError(f"IG container already published: {creation_id}")
+        # `status` carries the human-readable reason, e.g. "Error: ... (2207026)"
+        if status_code in _TERMINAL_BAD or status.upper().startswith(("ERROR", "EXPIRED")):
+            raise MetaError(f"IG container failed: {creation_id} ({status_code or 'ERROR'}: {status})")
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            break
+        interval = POLL_INTERVALS_S[attempt] if attempt < len(POLL_INTERVALS_S) else max_interval_sec
+        sleep(min(interval, max_interval_sec, remaining))
+        attempt += 1
     raise MetaError(f"IG container not ready before timeout ({timeout_sec}s): {creation_id}")
 
 
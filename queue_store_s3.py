@@ -1,47 +1,119 @@
 """
 S3-backed queue for approved social posts.
 
-Schema (JSON in S3):
+Layout (one JSON object per post in S3):
+  {QUEUE_S3_PREFIX}{id}.json    (default prefix "social/posts/")
+
+Each object:
 {
-  "posts": [
-    {
-      "id": "draft_1737060123456",
-      "status": "pending" | "approved",
-      "created_at": "2025-09-17T23:01:02.123456+00:00",
-      "caption": "...",
-      "media_url": "https://...",
-      "media_type": "image" | "video" | "reel" | "text",
-      "platforms": ["instagram","facebook"],
-      "source": "weekly|owner_input|manual|unknown",
-      "notes": "freeform",
-      "last_posted_at": { "instagram": "ISO-8601", "facebook": "ISO-8601" },
-      "history": [
-        {"ts":"ISO-8601","event":"approved"},
-        {"ts":"ISO-8601","event":"posted:instagram"}
-      ]
-    }
+  "id": "draft_1737060123456",
+  "status": "ingesting" | "ingest_failed" | "pending" | "approved",
+  "created_at": "2025-09-17T23:01:02.123456+00:00",
+  "created_at_ts": 1758150062.123456,
+  "caption": "...",
+  "media_url": "https://...",
+  "media_type": "image" | "video" | "reel" | "text",
+  "platforms": ["instagram","facebook"],
+  "source": "weekly|owner_input|manual|unknown",
+  "notes": "freeform",
+  "last_posted_at": { "instagram": "ISO-8601", "facebook": "ISO-8601" },
+  "last_posted_ts": { "instagram": 1758150062.1, "facebook": 1758150062.1 },
+  "posted_ts": { "instagram": [1758150062.1, ...] },   (publishes in the last 48h)
+  "history": [
+    {"ts":"ISO-8601","event":"approved"},
+    {"ts":"ISO-8601","event":"posted:instagram"}
   ]
 }
+
+Mutations touch only the affected object and use conditional writes
+(If-Match / If-None-Match) so concurrent writers cannot silently clobber
+each other. A legacy single-document queue at QUEUE_S3_KEY
+({"posts": [...]}) is split into per-post objects on first use.
 """
 
-import json
+import copy
 import os
+import random
+import threading
 import time
-from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, List, Optional
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 import boto3
+import orjson
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 # ---- Configuration via env ----
 BUCKET = os.getenv("QUEUE_S3_BUCKET") or ""
-KEY = os.getenv("QUEUE_S3_KEY") or "social/approved_posts.json"
+KEY = os.getenv("QUEUE_S3_KEY") or "social/approved_posts.json"  # legacy single-document queue
+PREFIX = os.getenv("QUEUE_S3_PREFIX") or "social/posts/"
+if not PREFIX.endswith("/"):
+    PREFIX += "/"
+MIGRATED_MARKER = f"{PREFIX}.migrated"  # written once the legacy KEY has been split
+JOBS_PREFIX = os.getenv("JOBS_S3_PREFIX") or "social/jobs/"
+if not JOBS_PREFIX.endswith("/"):
+    JOBS_PREFIX += "/"
 COOLDOWN_DAYS = int(os.getenv("RECENT_COOLDOWN_DAYS", "3"))
+FETCH_WORKERS = int(os.getenv("QUEUE_FETCH_WORKERS", "16"))
+WRITE_ATTEMPTS = 5
+POSTED_TS_RETENTION_S = 2 * 86400  # how long posted_ts entries are kept (daily caps)
+_CACHE_TTL = float(os.getenv("QUEUE_CACHE_TTL_S", "30"))  # 0 disables the listing cache
+# Media ingestion runs in the creating worker's memory; a draft still "ingesting"
+# after this long lost its job (worker recycled, finish_ingest failed).
+INGEST_STALE_S = float(os.getenv("INGEST_STALE_S", "900"))
+
+VALID_MEDIA_TYPES = frozenset({"image", "video", "reel", "text"})
+VALID_PLATFORMS = frozenset({"instagram", "facebook"})
+DEFAULT_PLATFORMS = ("instagram", "facebook")
+
+# Pool sized for the parallel per-post GETs; keep-alive avoids a TLS handshake per call.
+s3 = boto3.client("s3", config=Config(
+    max_pool_connections=max(50, FETCH_WORKERS),
+    retries={"mode": "adaptive", "max_attempts": 3},
+    tcp_keepalive=True,
+    connect_timeout=3,
+    read_timeout=10,
+    s3={"addressing_style": "virtual"},
+))
+
+_NOT_FOUND_CODES = ("404", "NoSuchKey", "NotFound")
+_draft_buffer = threading.local()  # .drafts / .failed while inside buffered_drafts()
+_migrated = False
+_migrate_lock = threading.Lock()
+
+# In-process cache of the queue, shared by gunicorn threads (not across workers):
+#   "listing": {key: etag} from the last prefix listing (None = never listed)
+#   "objs":    {key: (etag, post)} parsed bodies, re-fetched only when the ETag changes
+#   "ts":      monotonic time of the last listing
+#   "gen":     write counter, bumped by every local store/drop
+#   "written": {key: gen} of local writes not yet covered by a listing, so a
+#              refresh whose LIST raced with them doesn't undo them
+#   "approved_by_channel": {channel: {"keys": [...], "last_ts": [...], "created_ts": [...]}}
+#                          parallel arrays of approved posts per channel, pre-sorted
+#                          by (last_ts, created_ts); rebuilt lazily after any change
+#                          (None = stale)
+# Cached post dicts are never mutated in place (writes replace the entry), so
+# readers may hold references outside the lock as long as they don't modify them.
+_CACHE: Dict[str, Any] = {
+    "listing": None, "objs": {}, "ts": 0.0, "gen": 0, "written": {}, "approved_by_channel": None,
+}
+_cache_lock = threading.Lock()
+
 
-VALID_MEDIA_TYPES = {"image", "video", "reel", "text"}
-VALID_PLATFORMS = {"instagram", "facebook"}
+class QueueConflict(RuntimeError):
+    """Raised when a conditional write loses to a concurrent writer."""
 
-s3 = boto3.client("s3")
+
+class PostNotReady(RuntimeError):
+    """Raised when a post can't be approved yet (media ingesting or failed)."""
+
+    def __init__(self, post_id: str, status: str):
+        super().__init__(f"post_id {post_id} media is {status}")
+        self.status = status
 
 
 # ---- Time helpers ----
@@ -53,114 +125,449 @@ def _iso(dt: datetime) -> str:
     return dt.isoformat()
 
 
+def _iso_to_ts(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except Exception:
+        return None
+
+
+def _backfill_ts(p: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Derive epoch-second mirrors of created_at / last_posted_at for posts written
+    before they existed (persisted on the post's next write).
+    """
+    if "created_at_ts" not in p:
+        p["created_at_ts"] = _iso_to_ts(p.get("created_at")) or 0.0
+    lpt = p.setdefault("last_posted_ts", {})
+    for ch, iso in (p.get("last_posted_at") or {}).items():
+        if ch not in lpt:
+            ts = _iso_to_ts(iso)
+            if ts is not None:
+                lpt[ch] = ts
+    if "posted_ts" not in p:
+        cutoff = time.time() - POSTED_TS_RETENTION_S
+        posted: Dict[str, List[float]] = {}
+        for h in p.get("history") or []:
+            ev = h.get("event") or ""
+            if ev.startswith("posted:"):
+                ts = _iso_to_ts(h.get("ts"))
+                if ts is not None and ts >= cutoff:
+                    posted.setdefault(ev[len("posted:"):], []).append(ts)
+        p["posted_ts"] = posted
+    return p
+
+
+def _expire_stale_ingest(p: Dict[str, Any]) -> bool:
+    """Mark an "ingesting" post older than INGEST_STALE_S as ingest_failed. True if changed."""
+    if p.get("status") != "ingesting":
+        return False
+    started = p.get("ingest_started_ts") or p.get("created_at_ts") or 0.0
+    if time.time() - started <= INGEST_STALE_S:
+        return False
+    p["status"] = "ingest_failed"
+    p.setdefault("history", []).append(
+        {"ts": _iso(_now_utc()), "event": f"ingest_failed: no result after {int(INGEST_STALE_S)}s"}
+    )
+    return True
+
+
 # ---- S3 helpers ----
-def _empty_doc() -> Dict[str, Any]:
-    return {"posts": []}
+def _error_code(e: ClientError) -> Optional[str]:
+    return e.response.get("Error", {}).get("Code")
+
+
+def _require_bucket() -> None:
+    if not BUCKET:
+        raise RuntimeError("QUEUE_S3_BUCKET environment variable is not set")
+
+
+def _post_key(post_id: str) -> str:
+    return f"{PREFIX}{post_id}.json"
 
 
-def _ensure_bucket_key_exists() -> None:
+def _get_post(post_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
     """
-    If the JSON file doesn't exist, create it with an empty document.
+    Fetch a single post object. Returns (post, etag), or (None, None) if missing.
     """
+    return _get_key(_post_key(post_id))
+
+
+def _get_key(key: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    _require_bucket()
     try:
-        s3.head_object(Bucket=BUCKET, Key=KEY)
+        obj = s3.get_object(Bucket=BUCKET, Key=key)
     except ClientError as e:
-        code = e.response.get("Error", {}).get("Code")
-        if code in ("404", "NoSuchKey", "NotFound"):
-            s3.put_object(
-                Bucket=BUCKET,
-                Key=KEY,
-                Body=json.dumps(_empty_doc(), indent=2).encode("utf-8"),
-                ContentType="application/json",
-            )
-        else:
-            raise
+        if _error_code(e) in _NOT_FOUND_CODES:
+            _cache_drop(key)
+            return None, None
+        raise
+    raw = obj["Body"].read()
+    post, etag = orjson.loads(raw), obj.get("ETag")
+    if key.startswith(PREFIX):
+        _backfill_ts(post)
+        _cache_store(key, etag, post)
+    return post, etag
+
+
+# ---- Cache helpers ----
+def _cache_store(key: str, etag: Optional[str], post: Dict[str, Any]) -> None:
+    with _cache_lock:
+        _CACHE["objs"][key] = (etag, copy.deepcopy(post))
+        _CACHE["gen"] += 1
+        _CACHE["written"][key] = _CACHE["gen"]
+        if _CACHE["listing"] is not None:
+            _CACHE["listing"][key] = etag
+        _CACHE["approved_by_channel"] = None
+
+
+def _cache_drop(key: str) -> None:
+    with _cache_lock:
+        _CACHE["objs"].pop(key, None)
+        _CACHE["gen"] += 1
+        _CACHE["written"][key] = _CACHE["gen"]
+        if _CACHE["listing"] is not None:
+            _CACHE["listing"].pop(key, None)
+        _CACHE["approved_by_channel"] = None
+
+
+def _cache_fresh() -> bool:
+    """True if the cached listing is within TTL and fully populated (call under lock)."""
+    listing = _CACHE["listing"]
+    if listing is None or time.monotonic() - _CACHE["ts"] >= _CACHE_TTL:
+        return False
+    objs = _CACHE["objs"]
+    return all(k in objs for k in listing)
 
 
-def _load_queue() -> Dict[str, Any]:
+def _put_post(post: Dict[str, Any], if_match: Optional[str] = None, create: bool = False) -> None:
     """
-    Load the queue JSON from S3. (Imported by app.py as well.)
+    Write a single post object.
+    - if_match: only overwrite if the stored ETag still matches (optimistic concurrency)
+    - create:   only write if no object exists yet for this id
+    Raises QueueConflict when the precondition fails.
     """
-    if not BUCKET:
-        raise RuntimeError("QUEUE_S3_BUCKET environment variable is not set")
+    _require_bucket()
+    kwargs: Dict[str, Any] = {}
+    if if_match:
+        kwargs["IfMatch"] = if_match
+    elif create:
+        kwargs["IfNoneMatch"] = "*"
+    key = _post_key(post["id"])
     try:
-        obj = s3.get_object(Bucket=BUCKET, Key=KEY)
-        raw = obj["Body"].read()
-        return json.loads(raw.decode("utf-8"))
+        resp = s3.put_object(
+            Bucket=BUCKET,
+            Key=key,
+            Body=orjson.dumps(post, option=orjson.OPT_INDENT_2),
+            ContentType="application/json",
+            **kwargs,
+        )
     except ClientError as e:
-        code = e.response.get("Error", {}).get("Code")
-        if code in ("NoSuchKey", "404", "NotFound"):
-            _ensure_bucket_key_exists()
-            return _empty_doc()
+        if _error_code(e) in ("PreconditionFailed", "ConditionalRequestConflict"):
+            _cache_drop(key)
+            raise QueueConflict(f"concurrent update on post {post['id']}") from e
         raise
+    _cache_store(key, resp.get("ETag"), post)
 
 
-def _save_queue(data: Dict[str, Any]) -> None:
-    s3.put_object(
-        Bucket=BUCKET,
-        Key=KEY,
-        Body=json.dumps(data, indent=2).encode("utf-8"),
-        ContentType="application/json",
-    )
+def _list_post_etags() -> Dict[str, str]:
+    """Return {key: etag} for every post object under the prefix."""
+    _require_bucket()
+    listing: Dict[str, str] = {}
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=BUCKET, Prefix=PREFIX):
+        for item in page.get("Contents", []):
+            if item["Key"].endswith(".json"):
+                listing[item["Key"]] = item.get("ETag")
+    return listing
+
+
+def _migration_marked() -> bool:
+    try:
+        s3.head_object(Bucket=BUCKET, Key=MIGRATED_MARKER)
+        return True
+    except ClientError as e:
+        if _error_code(e) in _NOT_FOUND_CODES:
+            return False
+        raise
+
+
+def _migrate_legacy_queue() -> None:
+    """
+    One-time split of the legacy {"posts": [...]} document into per-post objects.
+    Existing per-post objects win. Completion is recorded durably in
+    MIGRATED_MARKER so later processes never re-split (which would resurrect
+    posts removed by delete_post); the legacy document is left in place.
+    """
+    global _migrated
+    if _migrated:
+        return
+    with _migrate_lock:
+        if _migrated:
+            return
+        _require_bucket()
+        if not _migration_marked():
+            legacy, _etag = _get_key(KEY)
+            for p in (legacy or {}).get("posts", []):
+                if not p.get("id"):
+                    continue
+                try:
+                    _put_post(_backfill_ts(p), create=True)
+                except QueueConflict:
+                    pass  # already migrated by a concurrent process
+            s3.put_object(
+                Bucket=BUCKET,
+                Key=MIGRATED_MARKER,
+                Body=orjson.dumps({"migrated_at": _iso(_now_utc()), "source": KEY}),
+                ContentType="application/json",
+            )
+        _migrated = True
+
+
+def _refresh_cache(force: bool = False) -> None:
+    """
+    Make sure the cache reflects S3. Within QUEUE_CACHE_TTL_S this is a no-op
+    (unless `force`); otherwise one LIST is issued and only objects whose ETag
+    changed are re-fetched (in parallel). Keys stored or dropped locally after
+    the LIST started keep their cached state rather than the listing's.
+    """
+    _migrate_legacy_queue()
+    with _cache_lock:
+        if not force and _cache_fresh():
+            return
+        gen0 = _CACHE["gen"]
+    listing = _list_post_etags()
+    with _cache_lock:
+        objs = _CACHE["objs"]
+        stale = [k for k, etag in listing.items() if k not in objs or objs[k][0] != etag]
+    if stale:
+        with ThreadPoolExecutor(max_workers=max(1, min(FETCH_WORKERS, len(stale)))) as ex:
+            list(ex.map(_get_key, stale))
+    with _cache_lock:
+        objs, written = _CACHE["objs"], _CACHE["written"]
+        newer = {k for k, g in written.items() if g > gen0}
+        listing = {k: etag for k, etag in listing.items() if k not in newer}
+        listing.update((k, objs[k][0]) for k in newer if k in objs)
+        for k in [k for k in objs if k not in listing]:
+            del objs[k]
+        _CACHE["written"] = {k: written[k] for k in newer}
+        _CACHE["listing"] = listing
+        _CACHE["ts"] = time.monotonic()
+        _CACHE["approved_by_channel"] = None
+
+
+def _cached_posts() -> List[Dict[str, Any]]:
+    """Read-only references to every cached post (refreshing first if needed)."""
+    _refresh_cache()
+    with _cache_lock:
+        objs = _CACHE["objs"]
+        return [objs[k][1] for k in _CACHE["listing"] if k in objs]
+
+
+def _approved_for_channel(channel: str) -> Dict[str, List[Any]]:
+    """
+    Scheduler index for `channel`: parallel keys / last_ts / created_ts arrays of
+    approved posts, sorted oldest-posted first (never posted = 0.0). Read-only.
+    """
+    _refresh_cache()
+    with _cache_lock:
+        index = _CACHE["approved_by_channel"]
+        if index is None:
+            objs = _CACHE["objs"]
+            rows: Dict[str, List[Tuple[float, float, str]]] = {ch: [] for ch in VALID_PLATFORMS}
+            for k in _CACHE["listing"]:
+                if k not in objs:
+                    continue
+                p = objs[k][1]
+                if p.get("status") != "approved":
+                    continue
+                last = p.get("last_posted_ts") or {}
+                created = p.get("created_at_ts") or 0.0
+                for ch in p.get("platforms") or []:
+                    if ch in rows:
+                        rows[ch].append((last.get(ch) or 0.0, created, k))
+            index = {}
+            for ch, r in rows.items():
+                r.sort()
+                index[ch] = {
+                    "keys": [k for _l, _c, k in r],
+                    "last_ts": [l for l, _c, _k in r],
+                    "created_ts": [c for _l, c, _k in r],
+                }
+            _CACHE["approved_by_channel"] = index
+        return index.get(channel) or {"keys": [], "last_ts": [], "created_ts": []}
+
+
+def _load_posts() -> List[Dict[str, Any]]:
+    """
+    Load every post under the prefix (private copies), oldest first.
+    """
+    posts = [copy.deepcopy(p) for p in _cached_posts()]
+    posts.sort(key=lambda p: p.get("created_at") or "")
+    return posts
 
 
 # ---- CRUD operations ----
+def _mutate_post(post_id: str, mutate: Callable[[Dict[str, Any]], None]) -> bool:
+    """
+    Read-modify-write one post with If-Match. If another writer got there first,
+    re-read and re-apply `mutate` (up to WRITE_ATTEMPTS, with jittered backoff).
+    Returns False if the post does not exist.
+    """
+    _migrate_legacy_queue()
+    for attempt in range(1, WRITE_ATTEMPTS + 1):
+        p, etag = _get_post(post_id)
+        if p is None:
+            return False
+        mutate(p)
+        try:
+            _put_post(p, if_match=etag)
+            return True
+        except QueueConflict:
+            if attempt == WRITE_ATTEMPTS:
+                raise
+            time.sleep(random.uniform(0.05, 0.2) * attempt)
+    return False
+
+
 def _normalize_draft(d: Dict[str, Any]) -> Dict[str, Any]:
     # status
     d.setdefault("status", "pending")
 
     # media_type
-    mt = (d.get("media_type") or "image").lower().strip()
+    mt = d.get("media_type")
+    mt = mt.lower().strip() if isinstance(mt, str) else "image"
     if mt not in VALID_MEDIA_TYPES:
         mt = "image"
     d["media_type"] = mt
 
-    # platforms
-    plats = d.get("platforms") or ["instagram", "facebook"]
-    if isinstance(plats, (list, tuple)):
-        plats = [str(x).lower().strip() for x in plats if str(x).lower().strip() in VALID_PLATFORMS]
-    else:
-        plats = ["instagram", "facebook"]
-    d["platforms"] = plats or ["instagram", "facebook"]
+    # platforms (single pass: normalize, validate, de-duplicate)
+    plats: List[str] = []
+    raw = d.get("platforms")
+    if isinstance(raw, (list, tuple)):
+        for x in raw:
+            ch = (x if isinstance(x, str) else str(x)).strip().lower()
+            if ch in VALID_PLATFORMS and ch not in plats:
+                plats.append(ch)
+    d["platforms"] = plats or list(DEFAULT_PLATFORMS)
 
     d.setdefault("source", "unknown")
     d.setdefault("notes", "")
     d.setdefault("last_posted_at", {})
+    d.setdefault("last_posted_ts", {})
     d.setdefault("history", [])
     return d
 
 
+def _new_draft_id() -> str:
+    """draft_<ms>_<random hex>: time-ordered, and unique across threads and workers."""
+    return f"draft_{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}"
+
+
+def _write_new_draft(draft: Dict[str, Any], explicit_id: Optional[str]) -> str:
+    # Ids are never reassigned: a buffered caller already holds this one, so an
+    # (unlikely) collision surfaces as QueueConflict rather than a silent re-id.
+    draft["id"] = explicit_id or draft.get("id") or _new_draft_id()
+    _put_post(draft, create=True)
+    return draft["id"]
+
+
+def _flush_drafts(buf: List[Tuple[Dict[str, Any], Optional[str]]], failed: Dict[str, str]) -> None:
+    """Write buffered drafts in parallel; record per-draft errors in `failed` {post_id: error}."""
+    pending, buf[:] = list(buf), []
+    if not pending:
+        return
+
+    def write(item: Tuple[Dict[str, Any], Optional[str]]) -> Optional[str]:
+        try:
+            _write_new_draft(*item)
+            return None
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"
+
+    with ThreadPoolExecutor(max_workers=max(1, min(FETCH_WORKERS, len(pending)))) as ex:
+        for (draft, _explicit_id), error in zip(pending, ex.map(write, pending)):
+            if error is not None:
+                failed[draft["id"]] = error
+
+
+@contextmanager
+def buffered_drafts(flush_at: int = 100) -> Iterator[Dict[str, str]]:
+    """
+    Batch add_draft() calls made on this thread: drafts are buffered and written
+    in parallel when `flush_at` accumulate and on exit, instead of one blocking
+    PUT per call. Nested blocks join the outermost one.
+
+    Yields a {post_id: error} dict of drafts that failed to write; it is complete
+    once the outermost block exits. Other drafts were stored under their ids.
+
+        with buffered_drafts() as failed:
+            ids = [add_draft(d) for d in drafts]
+        stored = [i for i in ids if i not in failed]
+    """
+    if getattr(_draft_buffer, "drafts", None) is not None:
+        yield _draft_buffer.failed
+        return
+    _draft_buffer.drafts = []
+    _draft_buffer.failed = failed = {}
+    _draft_buffer.flush_at = max(1, flush_at)
+    try:
+        yield failed
+    finally:
+        buf, _draft_buffer.drafts = _draft_buffer.drafts, None
+        _flush_drafts(buf, failed)
+
+
 def add_draft(draft: Dict[str, Any]) -> str:
     """
     Store a new draft with status=pending.
     Returns the generated post ID.
+    Inside buffered_drafts() the write is deferred until the buffer flushes;
+    write failures are then reported through the block's `failed` dict.
     """
-    data = _load_queue()
+    _migrate_legacy_queue()
     draft = _normalize_draft(draft)
-    draft_id = draft.get("id") or f"draft_{int(time.time()*1000)}"
-    draft["id"] = draft_id
-    draft["created_at"] = _iso(_now_utc())
-
-    data.setdefault("posts", [])
-    data["posts"].append(draft)
-    _save_queue(data)
-    return draft_id
+    now = _now_utc()
+    draft["created_at"] = _iso(now)
+    draft["created_at_ts"] = now.timestamp()
+    if draft["status"] == "ingesting":
+        draft["ingest_started_ts"] = draft["created_at_ts"]
+    explicit_id = draft.get("id")
+    buf = getattr(_draft_buffer, "drafts", None)
+    if buf is None:
+        return _write_new_draft(draft, explicit_id)
+    draft["id"] = explicit_id or _new_draft_id()
+    buf.append((draft, explicit_id))
+    if len(buf) >= _draft_buffer.flush_at:
+        _flush_drafts(buf, _draft_buffer.failed)
+    return draft["id"]
 
 
 def approve_post(post_id: str) -> bool:
     """
     Mark a draft as approved. Returns True if updated.
+    Raises PostNotReady (checked under If-Match) while media is ingesting or failed;
+    a stale ingest is persisted as ingest_failed first.
     """
-    data = _load_queue()
-    for p in data.get("posts", []):
-        if p.get("id") == post_id:
-            p["status"] = "approved"
-            p.setdefault("last_posted_at", {})
-            p.setdefault("history", [])
-            p["history"].append({"ts": _iso(_now_utc()), "event": "approved"})
-            _save_queue(data)
-            return True
-    return False
+    expired = {"now": False}
+
+    def mutate(p: Dict[str, Any]) -> None:
+        expired["now"] = _expire_stale_ingest(p)
+        if expired["now"]:
+            return  # write the ingest_failed verdict, then refuse below
+        if p.get("status") in ("ingesting", "ingest_failed"):
+            raise PostNotReady(post_id, p["status"])
+        p["status"] = "approved"
+        p.setdefault("last_posted_at", {})
+        p.setdefault("history", [])
+        p["history"].append({"ts": _iso(_now_utc()), "event": "approved"})
+
+    updated = _mutate_post(post_id, mutate)
+    if expired["now"]:
+        raise PostNotReady(post_id, "ingest_failed")
+    return updated
 
 
 def mark_posted(post_id: str, channel: str) -> bool:
@@ -171,31 +578,54 @@ def mark_posted(post_id: str, channel: str) -> bool:
     if channel not in VALID_PLATFORMS:
         return False
 
-    data = _load_queue()
-    for p in data.get("posts", []):
-        if p.get("id") == post_id:
-            p.setdefault("last_posted_at", {})
-            p["last_posted_at"][channel] = _iso(_now_utc())
-            p.setdefault("history", [])
-            p["history"].append({"ts": _iso(_now_utc()), "event": f"posted:{channel}"})
-            _save_queue(data)
-            return True
-    return False
+    def mutate(p: Dict[str, Any]) -> None:
+        now = _now_utc()
+        now_ts = now.timestamp()
+        p.setdefault("last_posted_at", {})
+        p["last_posted_at"][channel] = _iso(now)
+        p.setdefault("last_posted_ts", {})
+        p["last_posted_ts"][channel] = now_ts
+        posted = p.setdefault("posted_ts", {})
+        cutoff = now_ts - POSTED_TS_RETENTION_S
+        posted[channel] = [t for t in posted.get(channel, []) if t >= cutoff] + [now_ts]
+        p.setdefault("history", [])
+        p["history"].append({"ts": _iso(now), "event": f"posted:{channel}"})
+
+    return _mutate_post(post_id, mutate)
+
+
+def finish_ingest(post_id: str, media_s3_key: Optional[str] = None,
+                  error: Optional[str] = None) -> bool:
+    """
+    Finalize a draft created with status=ingesting once its media upload is done.
+    On success the S3 key is attached and the draft becomes pending; on failure
+    it is marked ingest_failed with the error in history.
+    """
+    def mutate(p: Dict[str, Any]) -> None:
+        p.setdefault("history", [])
+        if error:
+            p["history"].append({"ts": _iso(_now_utc()), "event": f"ingest_failed: {error}"})
+        else:
+            p["media_s3_key"] = media_s3_key
+            p["media_url"] = None
+            p["media_type"] = "image"
+            p["history"].append({"ts": _iso(_now_utc()), "event": "ingested"})
+        if p.get("status") == "ingesting":
+            p["status"] = "ingest_failed" if error else "pending"
+        elif p.get("status") == "ingest_failed" and not error:
+            p["status"] = "pending"  # finished after being declared stale
+
+    return _mutate_post(post_id, mutate)
 
 
 # ---- Selection logic for scheduler ----
-def _cooldown_ok(post: Dict[str, Any], channel: str, days: int = COOLDOWN_DAYS) -> bool:
+def _cooldown_elapsed(last_ts: float, days: int = COOLDOWN_DAYS) -> bool:
     """
     Enforce a minimum gap between re-using the same asset on a channel.
     """
-    lp = (post.get("last_posted_at") or {}).get(channel)
-    if not lp:
+    if not last_ts:
         return True
-    try:
-        last = datetime.fromisoformat(lp)
-    except Exception:
-        return True
-    return (_now_utc() - last) >= timedelta(days=days)
+    return (time.time() - last_ts) >= days * 86400
 
 
 def pick_next_for_channel(channel: str) -> Optional[Dict[str, Any]]:
@@ -204,52 +634,91 @@ def pick_next_for_channel(channel: str) -> Optional[Dict[str, Any]]:
     Strategy: among approved posts whose 'platforms' include channel and are
     outside cooldown, pick the one with the oldest last-posted-on-channel
     (or oldest created_at if never posted).
+    The index is pre-sorted by last-posted time, so candidates are tried from
+    its head. The index may be up to QUEUE_CACHE_TTL_S old (another worker may
+    have posted, unapproved or deleted the post since), so each candidate is
+    re-read from S3 and re-checked before it is returned.
     """
     channel = channel.lower().strip()
-    data = _load_queue()
-    approved: List[Dict[str, Any]] = [
-        p for p in data.get("posts", [])
-        if p.get("status") == "approved" and channel in (p.get("platforms") or [])
-    ]
-
-    def sort_key(p: Dict[str, Any]):
-        last = (p.get("last_posted_at") or {}).get(channel)
-        created = p.get("created_at") or "1970-01-01T00:00:00+00:00"
-        # Sort by last posted (None first), then by created_at
-        return (last or "1970-01-01T00:00:00+00:00", created)
-
-    approved.sort(key=sort_key)
-
-    for p in approved:
-        if _cooldown_ok(p, channel, COOLDOWN_DAYS):
+    idx = _approved_for_channel(channel)
+    for key, last_ts in zip(idx["keys"], idx["last_ts"]):
+        # last-posted times only grow, so once the cached one is in cooldown every
+        # later candidate is too
+        if not _cooldown_elapsed(last_ts, COOLDOWN_DAYS):
+            return None
+        p, _etag = _get_key(key)
+        if (p is not None and p.get("status") == "approved"
+                and channel in (p.get("platforms") or [])
+                and _cooldown_elapsed((p.get("last_posted_ts") or {}).get(channel) or 0.0, COOLDOWN_DAYS)):
             return p
     return None
 
 
+def recent_post_count(channel: str, window_s: float = 86400.0, fresh: bool = False) -> int:
+    """
+    Number of posts published to `channel` within the last `window_s` seconds
+    (at most POSTED_TS_RETENTION_S), from each post's posted_ts. Counts are shared
+    by every worker via S3; pass fresh=True to bypass the listing cache TTL.
+    """
+    channel = channel.lower().strip()
+    _refresh_cache(force=fresh)
+    cutoff = time.time() - window_s
+    count = 0
+    for p in _cached_posts():
+        for t in (p.get("posted_ts") or {}).get(channel) or ():
+            if t >= cutoff:
+                count += 1
+    return count
+
+
+# ---- Scheduler job records ----
+def save_job(job: Dict[str, Any]) -> None:
+    """Write a scheduler job record to {JOBS_S3_PREFIX}{id}.json (last write wins)."""
+    _require_bucket()
+    s3.put_object(
+        Bucket=BUCKET,
+        Key=f"{JOBS_PREFIX}{job['id']}.json",
+        Body=orjson.dumps(job, option=orjson.OPT_INDENT_2),
+        ContentType="application/json",
+    )
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    job, _etag = _get_key(f"{JOBS_PREFIX}{job_id}.json")
+    return job
+
+
 # ---- Optional admin helpers (handy for debugging) ----
 def list_posts(status: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
-    data = _load_queue()
-    posts = data.get("posts", [])
+    posts = _load_posts()
+    for p in posts:
+        _expire_stale_ingest(p)
     if status:
         posts = [p for p in posts if p.get("status") == status]
     return posts[:limit]
 
 
 def get_post(post_id: str) -> Optional[Dict[str, Any]]:
-    data = _load_queue()
-    for p in data.get("posts", []):
-        if p.get("id") == post_id:
-            return p
-    return None
+    _migrate_legacy_queue()
+    key = _post_key(post_id)
+    with _cache_lock:
+        hit = _CACHE["objs"].get(key) if _cache_fresh() else None
+    p = copy.deepcopy(hit[1]) if hit is not None else _get_post(post_id)[0]
+    if p is not None:
+        _expire_stale_ingest(p)  # reported on read; approve_post persists it
+    return p
 
 
 def delete_post(post_id: str) -> bool:
-    data = _load_queue()
-    before = len(data.get("posts", []))
-    data["posts"] = [p for p in data.get("posts", []) if p.get("id") != post_id]
-    after = len(data["posts"])
-    if after != before:
-        _save_queue(data)
-        return True
-    return False
-
+    _require_bucket()
+    _migrate_legacy_queue()
+    key = _post_key(post_id)
+    try:
+        s3.head_object(Bucket=BUCKET, Key=key)
+    except ClientError as e:
+        if _error_code(e) in _NOT_FOUND_CODES:
+            return False
+        raise
+    s3.delete_object(Bucket=BUCKET, Key=key)
+    _cache_drop(key)
+    return True
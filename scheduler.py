@@ -16,6 +16,7 @@ Timezone:
 from __future__ import annotations
 import os
 from datetime import datetime, date
+from functools import lru_cache
 try:
     from zoneinfo import ZoneInfo  # Python 3.9+
 except Exception:  # pragma: no cover
@@ -30,15 +31,20 @@ if ODD_AM not in ("instagram", "facebook"):
 
 CHANNELS = ("instagram", "facebook")
 
+# Resolve the zone once; None means fall back to naive local time.
+_TZ = None
+if ZoneInfo:
+    try:
+        _TZ = ZoneInfo(DEFAULT_TZ)
+    except Exception:
+        _TZ = None
+
 
 # ---------- Time helpers ----------
 def _now() -> datetime:
     """Current local time in the configured timezone."""
-    if ZoneInfo:
-        try:
-            return datetime.now(ZoneInfo(DEFAULT_TZ))
-        except Exception:
-            pass
+    if _TZ is not None:
+        return datetime.now(_TZ)
     # Fallback to naive local time if zone not available
     return datetime.now()
 
@@ -49,6 +55,18 @@ def _other(channel: str) -> str:
     return "facebook" if channel == "instagram" else "instagram"
 
 
+@lru_cache(maxsize=8)
+def _channels_for_yday(doy: int) -> tuple[str, str]:
+    """(am_channel, pm_channel) for a day-of-year; only parity matters."""
+    if doy % 2 == 1:  # odd
+        am = ODD_AM
+        pm = _other(ODD_AM)
+    else:             # even
+        am = _other(ODD_AM)
+        pm = ODD_AM
+    return am, pm
+
+
 # ---------- Public API ----------
 def channels_for_day(d: date | None = None) -> tuple[str, str]:
     """
@@ -57,14 +75,7 @@ def channels_for_day(d: date | None = None) -> tuple[str, str]:
     """
     if d is None:
         d = _now().date()
-    doy = d.timetuple().tm_yday
-    if doy % 2 == 1:  # odd
-        am = ODD_AM
-        pm = _other(ODD_AM)
-    else:             # even
-        am = _other(ODD_AM)
-        pm = ODD_AM
-    return am, pm
+    return _channels_for_yday(d.timetuple().tm_yday)
 
 
 def slot_channel_for_today(slot: str) -> str: